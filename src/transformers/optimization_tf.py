@@ -284,10 +284,13 @@ class GradientAccumulator(object):
     # We use the ON_READ synchronization policy so that no synchronization is
     # performed on assignment. To get the value, we call .value() which returns the
     # value on the current replica without synchronization.
+    # The gradients are accumulated in one flat buffer per dtype, so that each call
+    # performs one assignment per dtype instead of one per variable.
 
     def __init__(self):
         """Initializes the accumulator."""
-        self._gradients = []
+        self._flat_gradients = {}
+        self._partitions = []
         self._accum_steps = None
 
     @property
@@ -306,41 +309,55 @@ class GradientAccumulator(object):
     @property
     def gradients(self):
         """The accumulated gradients on the current replica."""
-        if not self._gradients:
+        if not self._partitions:
             raise ValueError("The accumulator should be called first to initialize the gradients")
-        return list(gradient.value() if gradient is not None else gradient for gradient in self._gradients)
+        flat_gradients = {dtype: gradient.value() for dtype, gradient in self._flat_gradients.items()}
+        return list(
+            tf.reshape(flat_gradients[dtype][offset : offset + size], shape) if dtype is not None else None
+            for dtype, offset, size, shape in self._partitions
+        )
 
     def __call__(self, gradients):
         """Accumulates :obj:`gradients` on the current replica."""
-        if not self._gradients:
+        if not self._partitions:
             _ = self.step  # Create the step variable.
-            self._gradients.extend(
-                [
-                    tf.Variable(
-                        tf.zeros_like(gradient),
-                        trainable=False,
-                        synchronization=tf.VariableSynchronization.ON_READ,
-                        aggregation=tf.VariableAggregation.ONLY_FIRST_REPLICA,
-                    )
-                    if gradient is not None
-                    else gradient
-                    for gradient in gradients
-                ]
-            )
-        if len(gradients) != len(self._gradients):
-            raise ValueError("Expected %s gradients, but got %d" % (len(self._gradients), len(gradients)))
-
-        for accum_gradient, gradient in zip(self._gradients, gradients):
-            if accum_gradient is not None and gradient is not None:
-                accum_gradient.assign_add(gradient)
+            sizes = {}
+            for gradient in gradients:
+                if gradient is None:
+                    self._partitions.append((None, None, None, None))
+                    continue
+                gradient = tf.convert_to_tensor(gradient)
+                offset = sizes.get(gradient.dtype, 0)
+                size = gradient.shape.num_elements()
+                self._partitions.append((gradient.dtype, offset, size, gradient.shape))
+                sizes[gradient.dtype] = offset + size
+            for dtype, size in sizes.items():
+                self._flat_gradients[dtype] = tf.Variable(
+                    tf.zeros([size], dtype=dtype),
+                    trainable=False,
+                    synchronization=tf.VariableSynchronization.ON_READ,
+                    aggregation=tf.VariableAggregation.ONLY_FIRST_REPLICA,
+                )
+        if len(gradients) != len(self._partitions):
+            raise ValueError("Expected %s gradients, but got %d" % (len(self._partitions), len(gradients)))
+
+        flat_gradients = {dtype: [] for dtype in self._flat_gradients}
+        for gradient, (dtype, _, size, _) in zip(gradients, self._partitions):
+            if dtype is None:
+                continue
+            if gradient is None:
+                flat_gradients[dtype].append(tf.zeros([size], dtype=dtype))
+            else:
+                flat_gradients[dtype].append(tf.reshape(gradient, [-1]))
+        for dtype, gradient in self._flat_gradients.items():
+            gradient.assign_add(tf.concat(flat_gradients[dtype], axis=0))
 
         self._accum_steps.assign_add(1)
 
     def reset(self):
         """Resets the accumulated gradients on the current replica."""
-        if not self._gradients:
+        if not self._partitions:
             return
         self._accum_steps.assign(0)
-        for gradient in self._gradients:
-            if gradient is not None:
-                gradient.assign(tf.zeros_like(gradient))
+        for gradient in self._flat_gradients.values():
+            gradient.assign(tf.zeros_like(gradient))
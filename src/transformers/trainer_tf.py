@@ -95,9 +95,17 @@ class TFTrainer:
         self.prediction_loss_only = prediction_loss_only
         self.optimizer, self.lr_scheduler = optimizers
         self.gradient_accumulator = GradientAccumulator()
+        # The metric is created once and reset at each evaluation, as the compiled eval steps capture it. It is
+        # created under the strategy so that every replica can update it.
+        with self.args.strategy.scope():
+            self.eval_loss = tf.keras.metrics.Mean()
         self.global_step = 0
         self.epoch_logging = 0
 
+        if self.args.xla:
+            self._compute_gradients = tf.function(self._compute_gradients, experimental_compile=True)
+            self._compute_eval_outputs = tf.function(self._compute_eval_outputs, experimental_compile=True)
+
         if tb_writer is not None:
             self.tb_writer = tb_writer
         else:
@@ -121,17 +129,22 @@ class TFTrainer:
             raise ValueError("Trainer: training requires a train_dataset.")
 
         self.total_train_batch_size = self.args.train_batch_size * self.args.gradient_accumulation_steps
-        self.num_train_examples = tf.data.experimental.cardinality(self.train_dataset).numpy()
+        self.num_train_examples = int(tf.data.experimental.cardinality(self.train_dataset))
 
         if self.num_train_examples < 0:
             raise ValueError("The training dataset must have an asserted cardinality")
 
         ds = (
-            self.train_dataset.repeat()
-            .shuffle(self.num_train_examples, seed=self.args.seed)
-            .batch(self.total_train_batch_size, drop_remainder=self.args.dataloader_drop_last)
+            self.train_dataset.shuffle(
+                min(self.num_train_examples, self.args.shuffle_buffer_size or 10000),
+                seed=self.args.seed,
+                reshuffle_each_iteration=True,
+            )
+            .repeat()
+            .batch(self.total_train_batch_size, drop_remainder=True)
             .prefetch(tf.data.experimental.AUTOTUNE)
         )
+        ds = self._apply_tf_data_options(ds, training=True)
 
         return self.args.strategy.experimental_distribute_dataset(ds)
 
@@ -147,18 +160,17 @@ class TFTrainer:
             raise ValueError("Trainer: evaluation requires an eval_dataset.")
 
         eval_dataset = eval_dataset if eval_dataset is not None else self.eval_dataset
-        num_examples = tf.data.experimental.cardinality(eval_dataset).numpy()
+        num_examples = int(tf.data.experimental.cardinality(eval_dataset))
 
         if num_examples < 0:
             raise ValueError("The training dataset must have an asserted cardinality")
 
         approx = math.floor if self.args.dataloader_drop_last else math.ceil
         steps = approx(num_examples / self.args.eval_batch_size)
-        ds = (
-            eval_dataset.repeat()
-            .batch(self.args.eval_batch_size, drop_remainder=self.args.dataloader_drop_last)
-            .prefetch(tf.data.experimental.AUTOTUNE)
+        ds = eval_dataset.batch(self.args.eval_batch_size, drop_remainder=self.args.dataloader_drop_last).prefetch(
+            tf.data.experimental.AUTOTUNE
         )
+        ds = self._apply_tf_data_options(ds)
 
         return self.args.strategy.experimental_distribute_dataset(ds), steps, num_examples
 
@@ -170,21 +182,38 @@ class TFTrainer:
             test_dataset (:class:`~tf.data.Dataset`): The dataset to use.
         """
 
-        num_examples = tf.data.experimental.cardinality(test_dataset).numpy()
+        num_examples = int(tf.data.experimental.cardinality(test_dataset))
 
         if num_examples < 0:
             raise ValueError("The training dataset must have an asserted cardinality")
 
         approx = math.floor if self.args.dataloader_drop_last else math.ceil
         steps = approx(num_examples / self.args.eval_batch_size)
-        ds = (
-            test_dataset.repeat()
-            .batch(self.args.eval_batch_size, drop_remainder=self.args.dataloader_drop_last)
-            .prefetch(tf.data.experimental.AUTOTUNE)
+        ds = test_dataset.batch(self.args.eval_batch_size, drop_remainder=self.args.dataloader_drop_last).prefetch(
+            tf.data.experimental.AUTOTUNE
         )
+        ds = self._apply_tf_data_options(ds)
 
         return self.args.strategy.experimental_distribute_dataset(ds), steps, num_examples
 
+    def _apply_tf_data_options(self, ds: tf.data.Dataset, training: bool = False) -> tf.data.Dataset:
+        """
+        Enables the static optimizations of the :obj:`tf.data` pipeline (map, batch and shuffle/repeat fusions).
+
+        The training dataset is also explicitly sharded by data across the workers. The pipelines are kept
+        deterministic, as this sharding relies on every worker producing the elements in the same order, and the
+        predictions have to keep the order of the evaluation and test datasets.
+        """
+        options = tf.data.Options()
+        options.experimental_optimization.map_and_batch_fusion = True
+        options.experimental_optimization.map_fusion = True
+        options.experimental_optimization.shuffle_and_repeat_fusion = True
+
+        if training:
+            options.experimental_distribute.auto_shard_policy = tf.data.experimental.AutoShardPolicy.DATA
+
+        return ds.with_options(options)
+
     def create_optimizer_and_scheduler(
         self, num_training_steps: int,
     ) -> Tuple[tf.keras.optimizers.Optimizer, tf.keras.optimizers.schedules.LearningRateSchedule]:
@@ -205,6 +234,22 @@ class TFTrainer:
                 weight_decay_rate=self.args.weight_decay,
             )
 
+    def _setup_mixed_precision(self):
+        """
+        Setup the ``mixed_float16`` policy and wrap the optimizer in a dynamic loss scale optimizer.
+        """
+        if parse(tf.__version__).release >= (2, 4, 0):
+            tf.keras.mixed_precision.set_global_policy("mixed_float16")
+
+            if not isinstance(self.optimizer, tf.keras.mixed_precision.LossScaleOptimizer):
+                self.optimizer = tf.keras.mixed_precision.LossScaleOptimizer(self.optimizer)
+        else:
+            policy = tf.keras.mixed_precision.experimental.Policy("mixed_float16")
+            tf.keras.mixed_precision.experimental.set_policy(policy)
+
+            if not isinstance(self.optimizer, tf.keras.mixed_precision.experimental.LossScaleOptimizer):
+                self.optimizer = tf.keras.mixed_precision.experimental.LossScaleOptimizer(self.optimizer, "dynamic")
+
     def _setup_wandb(self):
         """
         Setup the optional Weights & Biases (`wandb`) integration.
@@ -243,59 +288,48 @@ class TFTrainer:
 
         label_ids: np.ndarray = None
         preds: np.ndarray = None
-        self.eval_loss = tf.keras.metrics.Sum()
+        num_predicted = 0
+        self.eval_loss.reset_states()
 
         # Reset the past mems state at the beginning of the evaluation if necessary.
         if self.args.past_index >= 0:
             self._past = None
 
-        for step, batch in enumerate(dataset):
-            logits = self.distributed_test_steps(batch)
-            _, labels = batch
-
-            if not prediction_loss_only:
-                if isinstance(logits, tuple):
-                    logits = logits[0]
-
-                if isinstance(labels, tuple):
-                    labels = labels[0]
-
-                if self.args.n_replicas > 1:
-                    for val in logits.values:
-                        if preds is None:
-                            preds = val.numpy()
-                        else:
-                            preds = np.append(preds, val.numpy(), axis=0)
-
-                    for val in labels.values:
-                        if label_ids is None:
-                            label_ids = val.numpy()
-                        else:
-                            label_ids = np.append(label_ids, val.numpy(), axis=0)
-                else:
-                    if preds is None:
-                        preds = logits.numpy()
-                    else:
-                        preds = np.append(preds, logits.numpy(), axis=0)
-
-                    if label_ids is None:
-                        label_ids = labels.numpy()
-                    else:
-                        label_ids = np.append(label_ids, labels.numpy(), axis=0)
-
-                if step == steps:
-                    break
+        for batch in dataset:
+            # Only the loss is needed, so nothing has to be gathered and brought back to the host.
+            if prediction_loss_only:
+                self.distributed_test_steps(batch)
+                continue
+
+            # The outputs are gathered on the accelerator and copied to the host once per step, into buffers sized for
+            # the whole dataset. The loop stays in Python, as the past mems are Python state kept between steps.
+            logits, labels = self.distributed_prediction_steps(batch)
+            logits = logits.numpy()
+            labels = labels.numpy()
+
+            # The output buffers are allocated once, as soon as the shapes of the outputs are known.
+            if preds is None:
+                preds = np.empty((num_examples,) + logits.shape[1:], dtype=logits.dtype)
+                label_ids = np.empty((num_examples,) + labels.shape[1:], dtype=labels.dtype)
+
+            batch_size = logits.shape[0]
+            preds[num_predicted : num_predicted + batch_size] = logits
+            label_ids[num_predicted : num_predicted + batch_size] = labels
+            num_predicted += batch_size
+
+        # Some examples are not predicted when the last incomplete batch is dropped.
+        if preds is not None:
+            preds = preds[:num_predicted]
+            label_ids = label_ids[:num_predicted]
 
         if self.compute_metrics is not None and preds is not None and label_ids is not None:
             metrics = self.compute_metrics(EvalPrediction(predictions=preds, label_ids=label_ids))
         else:
             metrics = {}
 
-        metrics["eval_loss"] = self.eval_loss.result().numpy() / (steps * self.args.eval_batch_size)
+        metrics["eval_loss"] = float(self.eval_loss.result())
 
-        for key in list(metrics.keys()):
-            if not key.startswith("eval_"):
-                metrics[f"eval_{key}"] = metrics.pop(key)
+        metrics = {(key if key.startswith("eval_") else f"eval_{key}"): value for key, value in metrics.items()}
 
         if self.args.past_index and hasattr(self, "_past"):
             # Clean the state at the end of training
@@ -310,7 +344,6 @@ class TFTrainer:
             with self.tb_writer.as_default():
                 for k, v in logs.items():
                     tf.summary.scalar(k, v, step=self.global_step)
-            self.tb_writer.flush()
 
         if is_wandb_available():
             wandb.log(logs, step=self.global_step)
@@ -343,8 +376,17 @@ class TFTrainer:
 
         return output.metrics
 
+    def _compute_eval_outputs(self, features, labels):
+        """
+        Runs the forward pass on the given features and labels pair.
+
+        This is the part of the evaluation step compiled with XLA when :obj:`args.xla` is set. The update of the
+        evaluation loss metric stays outside of it.
+        """
+        return self._run_model(features, labels, False)
+
     def test_step(self, features, labels):
-        per_example_loss, logits = self._run_model(features, labels, False)
+        per_example_loss, logits = self._compute_eval_outputs(features, labels)
 
         self.eval_loss.update_state(per_example_loss)
 
@@ -356,6 +398,29 @@ class TFTrainer:
 
         return logits
 
+    def _gather_replicas(self, values):
+        """
+        Concatenates the per-replica ``values`` along the batch dimension on the accelerator, so only one tensor has
+        to be transferred to the host.
+        """
+        if parse(tf.__version__).release >= (2, 4, 0):
+            return self.args.strategy.gather(values, axis=0)
+
+        return tf.concat(self.args.strategy.experimental_local_results(values), axis=0)
+
+    @tf.function
+    def distributed_prediction_steps(self, batch):
+        logits = self.args.strategy.run(self.test_step, batch)
+        _, labels = batch
+
+        if isinstance(logits, tuple):
+            logits = logits[0]
+
+        if isinstance(labels, tuple):
+            labels = labels[0]
+
+        return self._gather_replicas(logits), self._gather_replicas(labels)
+
     def train(self) -> None:
         """
         Train method to train the model.
@@ -377,12 +442,25 @@ class TFTrainer:
 
         with self.args.strategy.scope():
             self.create_optimizer_and_scheduler(num_training_steps=t_total)
+
+            if self.args.fp16:
+                self._setup_mixed_precision()
+
             iterations = self.optimizer.iterations
-            self.global_step = iterations.numpy()
             folder = os.path.join(self.args.output_dir, PREFIX_CHECKPOINT_DIR)
             ckpt = tf.train.Checkpoint(optimizer=self.optimizer, model=self.model)
             self.model.ckpt_manager = tf.train.CheckpointManager(ckpt, folder, max_to_keep=self.args.save_total_limit)
 
+            if self.model.ckpt_manager.latest_checkpoint:
+                logger.info(
+                    "Checkpoint file %s found and restoring from checkpoint", self.model.ckpt_manager.latest_checkpoint
+                )
+
+                ckpt.restore(self.model.ckpt_manager.latest_checkpoint).expect_partial()
+
+            # The optimizer iterations are only read once, the step is tracked on the host from now on.
+            self.global_step = int(iterations.numpy())
+
             if self.model.ckpt_manager.latest_checkpoint:
                 epochs_trained = self.global_step // (self.num_train_examples // self.args.gradient_accumulation_steps)
                 steps_trained_in_current_epoch = self.global_step % (
@@ -393,11 +471,6 @@ class TFTrainer:
                 logger.info("  Continuing training from epoch %d", epochs_trained)
                 logger.info("  Continuing training from global step %d", self.global_step)
                 logger.info("  Will skip the first %d steps in the first epoch", steps_trained_in_current_epoch)
-                logger.info(
-                    "Checkpoint file %s found and restoring from checkpoint", self.model.ckpt_manager.latest_checkpoint
-                )
-
-                ckpt.restore(self.model.ckpt_manager.latest_checkpoint).expect_partial()
             else:
                 epochs_trained = 1
 
@@ -405,10 +478,6 @@ class TFTrainer:
 
             epochs = 1 if self.args.max_steps > 0 else self.args.num_train_epochs
 
-            if self.args.fp16:
-                policy = tf.keras.mixed_precision.experimental.Policy("mixed_float16")
-                tf.keras.mixed_precision.experimental.set_policy(policy)
-
             with self.tb_writer.as_default():
                 tf.summary.text("args", self.args.to_json_string())
 
@@ -434,16 +503,14 @@ class TFTrainer:
                     self._past = None
 
                 for step, batch in enumerate(train_ds):
-                    self.global_step = iterations.numpy()
                     self.epoch_logging = epoch_iter - 1 + (step + 1) / self.steps_per_epoch
 
                     self.distributed_training_steps(batch)
-
-                    training_loss = self.train_loss.result() / ((step + 1) * self.total_train_batch_size)
+                    self.global_step += 1
 
                     if self.args.debug:
                         logs = {}
-                        logs["loss"] = training_loss.numpy()
+                        logs["loss"] = self.train_loss.result().numpy() / ((step + 1) * self.total_train_batch_size)
                         logs["epoch"] = self.epoch_logging
 
                         self._log(logs)
@@ -465,7 +532,7 @@ class TFTrainer:
                         self.global_step == 1 and self.args.logging_first_step
                     ):
                         logs = {}
-                        logs["loss"] = training_loss.numpy()
+                        logs["loss"] = self.train_loss.result().numpy() / ((step + 1) * self.total_train_batch_size)
                         logs["learning_rate"] = self.lr_scheduler(self.global_step).numpy()
                         logs["epoch"] = self.epoch_logging
 
@@ -480,6 +547,7 @@ class TFTrainer:
                         break
 
                 self.train_loss.reset_states()
+                self.tb_writer.flush()
 
             end_time = datetime.datetime.now()
 
@@ -489,14 +557,34 @@ class TFTrainer:
             # Clean the state at the end of training
             delattr(self, "_past")
 
-    def training_step(self, features, labels):
-        per_example_loss, _ = self._run_model(features, labels, True)
-        scaled_loss = per_example_loss / self.total_train_batch_size
-        gradients = tf.gradients(scaled_loss, self.model.trainable_variables)
+    def _compute_gradients(self, features, labels):
+        """
+        Runs the forward and backward passes on the given features and labels pair.
+
+        This is the part of the training step compiled with XLA when :obj:`args.xla` is set. The gradient accumulation
+        stays outside of it, as XLA cannot lift the lazy creation of the accumulator variables.
+        """
+        with tf.GradientTape() as tape:
+            per_example_loss, _ = self._run_model(features, labels, True)
+            scaled_loss = per_example_loss / self.total_train_batch_size
+
+            if self.args.fp16:
+                scaled_loss = self.optimizer.get_scaled_loss(scaled_loss)
+
+        gradients = tape.gradient(scaled_loss, self.model.trainable_variables)
+
+        if self.args.fp16:
+            gradients = self.optimizer.get_unscaled_gradients(gradients)
+
         gradients = [
             g if g is not None else tf.zeros_like(v) for g, v in zip(gradients, self.model.trainable_variables)
         ]
 
+        return per_example_loss, gradients
+
+    def training_step(self, features, labels):
+        per_example_loss, gradients = self._compute_gradients(features, labels)
+
         if self.args.gradient_accumulation_steps > 1:
             self.gradient_accumulator(gradients)
 
@@ -511,25 +599,35 @@ class TFTrainer:
 
             self.optimizer.apply_gradients(list(zip(gradients, self.model.trainable_variables)))
         else:
-            for _ in tf.range(self.args.gradient_accumulation_steps):
-                reduced_features = features[: self.args.train_batch_size / self.args.n_replicas]
-                reduced_labels = labels[: self.args.train_batch_size / self.args.n_replicas]
+            accumulation_steps = self.args.gradient_accumulation_steps
+            micro_batch_size = self.args.train_batch_size // self.args.n_replicas
+
+            def _split_micro_batches(t):
+                # [accumulation_steps * micro_batch_size, ...] -> [accumulation_steps, micro_batch_size, ...]
+                return tf.reshape(t, tf.concat([[accumulation_steps, micro_batch_size], tf.shape(t)[1:]], axis=0))
+
+            feature_chunks = tf.nest.map_structure(_split_micro_batches, features)
+            label_chunks = tf.nest.map_structure(_split_micro_batches, labels)
+
+            def _accumulation_step(step):
+                reduced_features = tf.nest.map_structure(lambda t: t[step], feature_chunks)
+                reduced_labels = tf.nest.map_structure(lambda t: t[step], label_chunks)
 
                 self.training_step(reduced_features, reduced_labels)
 
-                features = tf.concat(
-                    [features[self.args.train_batch_size / self.args.n_replicas :], reduced_features], axis=0
-                )
+                return (step + 1,)
+
+            tf.while_loop(lambda step: step < accumulation_steps, _accumulation_step, (tf.constant(0),))
 
             gradients = self.gradient_accumulator.gradients
-            gradients = [
-                (tf.clip_by_value(grad, -self.args.max_grad_norm, self.args.max_grad_norm)) for grad in gradients
-            ]
+
+            if self.args.max_grad_norm and self.args.max_grad_norm > 0:
+                gradients, _ = tf.clip_by_global_norm(gradients, self.args.max_grad_norm)
 
             self.optimizer.apply_gradients(list(zip(gradients, self.model.trainable_variables)))
             self.gradient_accumulator.reset()
 
-    @tf.function
+    @tf.function(experimental_relax_shapes=True)
     def distributed_training_steps(self, batch):
         with self.args.strategy.scope():
             self.args.strategy.run(self.apply_gradients, batch)
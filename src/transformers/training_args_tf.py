@@ -95,12 +95,27 @@ class TFTrainingArguments(TrainingArguments):
             at the next training step under the keyword argument ``mems``.
         tpu_name (:obj:`str`, `optional`):
             The name of the TPU the process is running on.
+        shuffle_buffer_size (:obj:`int`, `optional`, defaults to 10000):
+            The maximum number of training examples held in the shuffle buffer. Falls back to 10000 if set to
+            :obj:`None` or 0.
+        xla (:obj:`bool`, `optional`, defaults to :obj:`False`):
+            Whether to compile the forward and backward passes of the training step, and the forward pass of the
+            evaluation step, with XLA or not. The gradient accumulation, the optimizer update and the loss metrics are
+            not compiled.
     """
 
     tpu_name: str = field(
         default=None, metadata={"help": "Name of TPU"},
     )
 
+    shuffle_buffer_size: int = field(
+        default=10000, metadata={"help": "Maximum number of training examples held in the shuffle buffer."}
+    )
+
+    xla: bool = field(
+        default=False, metadata={"help": "Whether to compile the forward and backward passes with XLA or not"}
+    )
+
     @cached_property
     @tf_required
     def _setup_strategy(self) -> Tuple["tf.distribute.Strategy", int]:
@@ -32,6 +32,30 @@ class OptimizationFTest(unittest.TestCase):
         self.assertEqual(accumulator.step, 0)
         self.assertListAlmostEqual(accumulator.gradients[0].numpy().tolist(), [0.0, 0.0], tol=1e-2)
 
+    def testGradientAccumulatorMultipleGradients(self):
+        accumulator = GradientAccumulator()
+        accumulator([tf.constant([[1.0, 2.0], [3.0, 4.0]]), None, tf.constant([1.0])])
+        accumulator([tf.constant([[1.0, 1.0], [1.0, 1.0]]), None, tf.constant([2.0])])
+        self.assertEqual(accumulator.step, 2)
+        gradients = accumulator.gradients
+        self.assertEqual(len(gradients), 3)
+        self.assertEqual(gradients[0].shape, (2, 2))
+        self.assertListAlmostEqual(tf.reshape(gradients[0], [-1]).numpy().tolist(), [2.0, 3.0, 4.0, 5.0], tol=1e-2)
+        self.assertIsNone(gradients[1])
+        self.assertListAlmostEqual(gradients[2].numpy().tolist(), [3.0], tol=1e-2)
+
+    def testGradientAccumulatorMixedDtypes(self):
+        accumulator = GradientAccumulator()
+        accumulator([tf.constant([1.0], dtype=tf.float16), tf.constant([1.0, 2.0])])
+        accumulator([tf.constant([2.0], dtype=tf.float16), tf.constant([3.0, 4.0])])
+        gradients = accumulator.gradients
+        self.assertEqual(gradients[0].dtype, tf.float16)
+        self.assertEqual(gradients[1].dtype, tf.float32)
+        self.assertListAlmostEqual(gradients[0].numpy().tolist(), [3.0], tol=1e-2)
+        self.assertListAlmostEqual(gradients[1].numpy().tolist(), [4.0, 6.0], tol=1e-2)
+        accumulator.reset()
+        self.assertListAlmostEqual(accumulator.gradients[0].numpy().tolist(), [0.0], tol=1e-2)
+
     def testGradientAccumulatorDistributionStrategy(self):
         context._context = None
         ops.enable_eager_execution_internal()
@@ -69,7 +93,7 @@ class OptimizationFTest(unittest.TestCase):
                 strategy.experimental_run_v2(apply_on_replica)
 
         def _check_local_values(grad1, grad2):
-            values = strategy.experimental_local_results(accumulator._gradients[0])
+            values = strategy.experimental_local_results(accumulator._flat_gradients[tf.float32])
             self.assertListAlmostEqual(values[0].value(), grad1, tol=1e-2)
             self.assertListAlmostEqual(values[1].value(), grad2, tol=1e-2)
 